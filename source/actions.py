@@ -86,6 +86,7 @@ class PurifyAction(Action):
     '''Should be called if standing on a corrupted tile and want to purify it'''
     def perform(self) -> None:
         self.engine.game_map.tiles[self.entity.x,self.entity.y]=tile_types.floor
+        self.engine.game_map.invalidate_tile_caches()
 
         self.engine.message_log.add_message(
             f"{self.entity.name.capitalize()} purifies corruption", color.white
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""Compile the AI kernels ahead of time into the ai_kernels extension module.
+
+Run this once from the source directory after installing numba.  When the
+extension is present kernels.py uses it, so the game starts without waiting on
+the JIT and doesn't need numba at runtime.  It is not rebuilt automatically, so
+run this again after changing kernels.py.
+"""
+from numba.pycc import CC  # type: ignore
+
+import kernels
+
+cc = CC("ai_kernels")
+
+cc.export(
+    "closest_hostile",
+    "UniTuple(i8, 2)(b1[:, :], i4[:], i4[:], i4[:], i8, i8, i8, i8)",
+)(kernels._jit_closest_hostile.py_func)
+cc.export(
+    "astar_path",
+    "i4[:, :](i1[:, :], u8[:, :], i8, i8, i8, i8, i8)",
+)(kernels._jit_astar_path.py_func)
+
+
+if __name__ == "__main__":
+    cc.compile()
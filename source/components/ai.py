@@ -1,115 +1,224 @@
 from __future__ import annotations
 
-from typing import List, Tuple, TYPE_CHECKING
+from typing import Optional, Tuple, TYPE_CHECKING
 
 import numpy as np  # type: ignore
-import tcod
 from tcod.map import compute_fov
 import random
+import exceptions
 import tile_types
 
 from actions import Action, MeleeAction, MovementAction, WaitAction, PurifyAction
+from kernels import closest_hostile
 
 if TYPE_CHECKING:
     from entity import Actor
 
+# (dx, dy, cost) of the eight steps an actor can take, weighted the same way as
+# the cardinal=2, diagonal=3 pathfinding graphs.
+NEIGHBOR_STEPS = (
+    (-1, -1, 3), (0, -1, 2), (1, -1, 3),
+    (-1, 0, 2), (1, 0, 2),
+    (-1, 1, 3), (0, 1, 2), (1, 1, 3),
+)
+# Distance tcod reports for tiles that can't be reached.
+UNREACHABLE = int(np.iinfo(np.int32).max)
+# Path of an actor that isn't following one.
+NO_PATH = np.empty((0, 2), dtype=np.int32)
+# How far actors can see.
+FOV_RADIUS = 8
+# Most a chase path may cost.  Targets are always in view, so this leaves room for
+# paths twice the FOV radius long even if every step is diagonal, plus the +10
+# get_movement_cost adds to the target's own tile since it blocks movement.
+CHASE_MAX_COST = 2 * FOV_RADIUS * 3 + 10 * 3
+
 
 class BaseAI(Action):
+    def __init__(self, entity: Actor):
+        super().__init__(entity)
+        # the path being followed, path_i is the index of the next step to take
+        self.path: np.ndarray = NO_PATH
+        self.path_i = 0
+        # where the chase target stood when the current path to it was planned
+        self.path_target_xy: Optional[Tuple[int, int]] = None
 
     def perform(self) -> None:
         raise NotImplementedError()
 
-    def get_path_to(self, dest_x: int, dest_y: int) -> List[Tuple[int, int]]:
-        """Compute and return a path to the target position.
+    def set_path(self, path: np.ndarray) -> None:
+        """Start following an (L, 2) array of path steps from its first step."""
+        self.path = path
+        self.path_i = 0
+        self.path_target_xy = None
 
-        If there is no valid path then returns an empty list.
-        """
-        # Copy the walkable array.
-        cost = np.array(self.entity.gamemap.tiles["walkable"], dtype=np.int8)
+    def has_path(self) -> bool:
+        """Return True while there are steps left on the current path."""
+        return self.path_i < len(self.path)
 
-        for entity in self.entity.gamemap.entities:
-            # Check that an enitiy blocks movement and the cost isn't zero (blocking.)
-            if entity.blocks_movement and cost[entity.x, entity.y]:
-                # Add to the cost of a blocked position.
-                # A lower number means more enemies will crowd behind each other in
-                # hallways.  A higher number means enemies will take longer paths in
-                # order to surround the player.
-                cost[entity.x, entity.y] += 10
+    def get_next_path_step(self) -> Tuple[int, int]:
+        """Return the tile the next step on the current path leads to."""
+        return int(self.path[self.path_i, 0]), int(self.path[self.path_i, 1])
 
-        # Create a graph from the cost array and pass that graph to a new pathfinder.
-        graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
-        pathfinder = tcod.path.Pathfinder(graph)
+    def take_path_step(self) -> None:
+        """Move to the next step on the current path.
 
-        pathfinder.add_root((self.entity.x, self.entity.y))  # Start position.
+        If the step is blocked the path is dropped, so a fresh one gets planned.
+        """
+        dest_x, dest_y = self.get_next_path_step()
+        try:
+            MovementAction(
+                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
+            ).perform()
+        except exceptions.Impossible:
+            self.set_path(NO_PATH)
+            raise
+        self.path_i += 1
+
+    def get_path_to(
+        self, dest_x: int, dest_y: int, max_cost: Optional[int] = None
+    ) -> np.ndarray:
+        """Compute and return a path to the target position as an (L, 2) array.
+
+        If there is no valid path, or none costing at most max_cost, then returns
+        an empty array.
+        """
+        gamemap = self.entity.gamemap
+        if max_cost is None:
+            max_cost = UNREACHABLE
+
+        # The start position is left out of the path.
+        return gamemap.astar_path(
+            gamemap.get_movement_cost(),
+            gamemap.walkable_bits,
+            self.entity.x,
+            self.entity.y,
+            dest_x,
+            dest_y,
+            max_cost,
+        )
+    
+    def get_step_toward_player(self) -> Optional[Tuple[int, int]]:
+        """Return the (dx, dy) step leading downhill on the engine's distance map.
 
-        # Compute the path to the destination and remove the starting point.
-        path: List[List[int]] = pathfinder.path_to((dest_x, dest_y))[1:].tolist()
+        If no neighboring tile can reach the player then returns None.
+        """
+        dist_map = self.engine.dist_map
+        gamemap = self.entity.gamemap
+        best_step = None
+        best_cost = UNREACHABLE
+        for dx, dy, step_cost in NEIGHBOR_STEPS:
+            x, y = self.entity.x + dx, self.entity.y + dy
+            if not gamemap.in_bounds(x, y) or dist_map[x, y] == UNREACHABLE:
+                continue
+            cost = int(dist_map[x, y]) + step_cost
+            if cost < best_cost:
+                best_step = (dx, dy)
+                best_cost = cost
+
+        return best_step
+
+    def move_toward(self, target: Actor) -> bool:
+        """Take the next step on a path to target.
+
+        The player is chased using the shared distance map.  Any other target is
+        searched for with A*, and the path is kept and followed on later turns
+        until the target moves or the next step is blocked.  If there is no valid
+        path then returns False without moving.
+        """
+        if target is self.engine.player:
+            self.set_path(NO_PATH)
+            step = self.get_step_toward_player()
+            if step is None:
+                return False
+            MovementAction(self.entity, *step).perform()
+            return True
+
+        if (target.x, target.y) != self.path_target_xy or not self.is_next_step_open():
+            path = self.get_path_to(target.x, target.y, CHASE_MAX_COST)
+            self.set_path(path)
+            self.path_target_xy = (target.x, target.y)
+
+        if not self.has_path():
+            return False
+
+        self.take_path_step()
+        return True
+
+    def is_next_step_open(self) -> bool:
+        """Return True if the next path step can be entered."""
+        if not self.has_path():
+            return False
+
+        dest_x, dest_y = self.get_next_path_step()
+        gamemap = self.entity.gamemap
+        return bool(gamemap.tiles["walkable"][dest_x, dest_y]) and (
+            gamemap.get_blocking_entity_at_location(dest_x, dest_y) is None
+        )
 
-        # Convert from List[List[int]] to List[Tuple[int, int]].
-        return [(index[0], index[1]) for index in path]
-    
     def get_fov(self):
-        """Recompute the visible area based on self's point of view."""
-        return compute_fov(
-            self.entity.gamemap.tiles["transparent"],
-            (self.entity.x, self.entity.y),
-            radius=8,
-        )
+        """Return the visible area based on self's point of view.
+
+        FOVs are cached on the engine for the rest of the tick, so the returned
+        array must not be modified.
+        """
+        engine = self.engine
+        gamemap = self.entity.gamemap
+        if engine.fov_cache_version != gamemap.tiles_version:
+            # The terrain changed, every cached FOV may be stale.
+            engine.fov_cache.clear()
+            engine.fov_cache_version = gamemap.tiles_version
+
+        key = (self.entity.x, self.entity.y, FOV_RADIUS)
+        fov = engine.fov_cache.get(key)
+        if fov is None:
+            fov = compute_fov(
+                gamemap.transparent_arr,
+                (self.entity.x, self.entity.y),
+                radius=FOV_RADIUS,
+            )
+            engine.fov_cache[key] = fov
+
+        return fov
     
-    def get_actors_in_fov(self):
-        '''Gets all non-ally actors within fov of self, sorted by distance from self'''
+    def get_closest_hostile_in_fov(self) -> Tuple[Optional[Actor], int]:
+        '''Gets the closest non-ally actor within fov of self, and its distance from self'''
         fov=self.get_fov()
-        actors_in_fov=[]
-        distances=[]
-        for target in set(self.entity.gamemap.actors) - {self.entity}:
-            if fov[target.x,target.y]:
-                if target.faction!=self.entity.faction:
-                    #the target entity you're checking is within fov of self
-                    actors_in_fov.append(target)
-                    dx = target.x - self.entity.x
-                    dy = target.y - self.entity.y
-                    distance = max(abs(dx), abs(dy))  # Chebyshev distance.
-                    distances.append(distance)
-
-        if len(actors_in_fov)==0:
-            return None,None
-
-        idx_sort=np.argsort(distances)
-        actors_in_fov_sorted=np.array(actors_in_fov)[idx_sort]
-        distances_sorted=np.array(distances)[idx_sort]
-
-        return actors_in_fov_sorted,distances_sorted
+        gamemap=self.entity.gamemap
+        index,distance=closest_hostile(
+            fov,
+            gamemap.actor_xs,
+            gamemap.actor_ys,
+            gamemap.actor_factions,
+            self.entity.x,
+            self.entity.y,
+            self.entity.faction,
+            FOV_RADIUS,
+        )
+
+        if index==-1:
+            return None,-1
+
+        # the kernels hand back numpy ints when they run uncompiled
+        return gamemap.actor_list[int(index)],int(distance)
 
     
 class HostileEnemy(BaseAI):
-    def __init__(self, entity: Actor):
-        super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
-
     def perform(self) -> None:
         # hostile enemies can target any non-ally Actor
         # they will target the closest Actor that is within their vision
-        actors_in_fov_sorted,distances_sorted=self.get_actors_in_fov()
+        target,distance=self.get_closest_hostile_in_fov()
 
-        if actors_in_fov_sorted is None:
+        if target is None:
             return WaitAction(self.entity).perform()
         
-        target=actors_in_fov_sorted[0]
-        distance=distances_sorted[0]
-        
         dx = target.x - self.entity.x
         dy = target.y - self.entity.y
 
         if distance <= 1:
             return MeleeAction(self.entity, dx, dy).perform()
 
-        self.path = self.get_path_to(target.x, target.y)
-
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+        if self.move_toward(target):
+            return None
         
         return WaitAction(self.entity).perform()
 
@@ -117,18 +226,16 @@ class Orc(BaseAI):
     '''Orcs chase non-allies, then wander to a random spot, then return home'''
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
         self.home: Tuple[int, int] = (-999,-999)
+        self.last_target_xy: Optional[Tuple[int, int]] = None
 
     def perform(self) -> None:
         # when you first spawn in, set your home location to your current spot
         if self.home[0]==-999:
             self.home = (self.entity.x,self.entity.y)
 
-        actors_in_fov_sorted,distances_sorted=self.get_actors_in_fov()
-        if actors_in_fov_sorted is not None:
-            target=actors_in_fov_sorted[0]
-            distance=distances_sorted[0]
+        target,distance=self.get_closest_hostile_in_fov()
+        if target is not None:
             
             dx = target.x - self.entity.x
             dy = target.y - self.entity.y
@@ -136,29 +243,31 @@ class Orc(BaseAI):
             if distance <= 1:
                 return MeleeAction(self.entity, dx, dy).perform()
             
-            self.path = self.get_path_to(target.x, target.y)
-
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            # once you move, the path will have one fewer step
-            self.path=self.path[1:]
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+            # remember where the target is, so you can follow it if it slips out of view
+            self.last_target_xy = (target.x, target.y)
+            if self.move_toward(target):
+                return None
+
+        elif self.last_target_xy is not None:
+            # you lost sight of your target, head to where you last saw it
+            self.set_path(self.get_path_to(*self.last_target_xy))
+            self.last_target_xy = None
+
+        if self.has_path():
+            return self.take_path_step()
         
         # if you don't have a path, you either just got home or you just got to the place you're wandering to
         elif (self.entity.x,self.entity.y) == self.home:
             # you're at your home location
 
             # pick a new wander destination, which is just a random walkable tile
-            arr=self.entity.gamemap.tiles['walkable']
-            x_idx, y_idx = np.where(arr)
-            rand=random.randint(0,len(x_idx)-1) #randint includes both bounds
+            x_idx, y_idx = self.entity.gamemap.walkable_indices
+            rand=random.randrange(len(x_idx))
 
-            self.path=self.get_path_to(x_idx[rand], y_idx[rand])
+            self.set_path(self.get_path_to(int(x_idx[rand]), int(y_idx[rand])))
         else:
             # you have no path and you're not home, go home
-            self.path=self.get_path_to(self.home[0], self.home[1])
+            self.set_path(self.get_path_to(self.home[0], self.home[1]))
 
         return WaitAction(self.entity).perform()
     
@@ -166,18 +275,16 @@ class Troll(BaseAI):
     '''Trolls just chase non-allies and then return home'''
     def __init__(self, entity: Actor):
         super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
         self.home: Tuple[int, int] = (-999,-999)
+        self.last_target_xy: Optional[Tuple[int, int]] = None
 
     def perform(self) -> None:
         # when you first spawn in, set your home location to your current spot
         if self.home[0]==-999:
             self.home = (self.entity.x,self.entity.y)
 
-        actors_in_fov_sorted,distances_sorted=self.get_actors_in_fov()
-        if actors_in_fov_sorted is not None:
-            target=actors_in_fov_sorted[0]
-            distance=distances_sorted[0]
+        target,distance=self.get_closest_hostile_in_fov()
+        if target is not None:
             
             dx = target.x - self.entity.x
             dy = target.y - self.entity.y
@@ -185,15 +292,18 @@ class Troll(BaseAI):
             if distance <= 1:
                 return MeleeAction(self.entity, dx, dy).perform()
             
-            self.path = self.get_path_to(target.x, target.y)
-
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            # once you move, the path will have one fewer step
-            self.path=self.path[1:]
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+            # remember where the target is, so you can follow it if it slips out of view
+            self.last_target_xy = (target.x, target.y)
+            if self.move_toward(target):
+                return None
+
+        elif self.last_target_xy is not None:
+            # you lost sight of your target, head to where you last saw it
+            self.set_path(self.get_path_to(*self.last_target_xy))
+            self.last_target_xy = None
+
+        if self.has_path():
+            return self.take_path_step()
         
         # if you don't have a path, you either just got home or you just stopped chasing something
         elif (self.entity.x,self.entity.y) == self.home:
@@ -201,30 +311,26 @@ class Troll(BaseAI):
             return WaitAction(self.entity).perform()
         else:
             # you have no path and you're not home, go home
-            self.path=self.get_path_to(self.home[0], self.home[1])
+            self.set_path(self.get_path_to(self.home[0], self.home[1]))
 
         return WaitAction(self.entity).perform()
     
 class Animal(BaseAI):
     '''Animals run away from non-allies and wander'''
-    def __init__(self, entity: Actor):
-        super().__init__(entity)
-        self.path: List[Tuple[int, int]] = []
-
     def perform(self) -> None:
         # if there is an Actor in your fov that is not in your faction, run away from it
-        actors_in_fov_sorted,distances_sorted=self.get_actors_in_fov()
+        target,_=self.get_closest_hostile_in_fov()
 
-        if actors_in_fov_sorted is not None:
+        if target is not None:
 
             # reset wander path because evading does not follow self.path
-            self.path=[]
+            self.set_path(NO_PATH)
 
-            target=actors_in_fov_sorted[0]
             # want to return dx,dy of 0,-1, or 1 with the proper direction
-            # if (target.x - self.entity.x)>0 return 1, if =0 return 0, if <0 return -1, luckily np.sign does this
-            dx = np.sign(target.x - self.entity.x)
-            dy = np.sign(target.y - self.entity.y)
+            # if (target.x - self.entity.x)>0 return 1, if =0 return 0, if <0 return -1
+            # comparing the ints directly avoids a numpy ufunc call for a single number
+            dx = (target.x > self.entity.x) - (target.x < self.entity.x)
+            dy = (target.y > self.entity.y) - (target.y < self.entity.y)
             # move away from the target
             return MovementAction(self.entity,-dx,-dy).perform()
         
@@ -232,22 +338,16 @@ class Animal(BaseAI):
         if self.engine.game_map.tiles[self.entity.x,self.entity.y]==tile_types.corrupted_floor:
             return PurifyAction(self.entity).perform()
         
-        # if []: will return False, so when the path runs out it will pick a new path
+        # when the path runs out it will pick a new path
         # if you have a path you're wandering toward, head there
-        if self.path:
-            dest_x, dest_y = self.path.pop(0)
-            # once you move, the path will have one fewer step
-            self.path=self.path[1:]
-            return MovementAction(
-                self.entity, dest_x - self.entity.x, dest_y - self.entity.y,
-            ).perform()
+        if self.has_path():
+            return self.take_path_step()
         else:
             # pick a new wander destination, which is just a random walkable tile
-            arr=self.entity.gamemap.tiles['walkable']
-            x_idx, y_idx = np.where(arr)
-            rand=random.randint(0,len(x_idx)-1) #randint includes both bounds
+            x_idx, y_idx = self.entity.gamemap.walkable_indices
+            rand=random.randrange(len(x_idx))
 
-            self.path=self.get_path_to(x_idx[rand], y_idx[rand])
+            self.set_path(self.get_path_to(int(x_idx[rand]), int(y_idx[rand])))
     
         return WaitAction(self.entity).perform()
         
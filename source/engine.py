@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np
+import tcod
 from tcod.console import Console
 
 from tcod.map import compute_fov
@@ -27,9 +28,23 @@ class Engine:
         self.message_log = MessageLog()
         self.mouse_location = (0, 0)
         self.player = player
+        self._dist_map: Optional[np.ndarray] = None
+        # Actor FOVs keyed by (x, y, radius), reused by actors sharing a tile
+        # within a tick.  Only valid for the game map's fov_cache_version.
+        self.fov_cache: Dict[Tuple[int, int, int], np.ndarray] = {}
+        self.fov_cache_version = -1
 
     def handle_enemy_turns(self) -> None:
-        for entity in set(self.game_map.actors) - {self.player}:
+        # The player only moves between ticks, so the distance map is built at
+        # most once per tick and shared by every actor chasing the player.
+        self._dist_map = None
+
+        self.fov_cache.clear()
+
+        # Snapshot the actors, a turn can change the entities set being iterated.
+        for entity in list(self.game_map.actors):
+            if entity is self.player:
+                continue
             if entity.ai:
                 try:
                     entity.ai.perform()
@@ -38,10 +53,23 @@ class Engine:
 
         self.tick+=1 # track how many game ticks have elapsed
 
+    @property
+    def dist_map(self) -> np.ndarray:
+        """Return the path cost from the player to every tile on the map."""
+        if self._dist_map is None:
+            cost = self.game_map.get_movement_cost()
+            graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+            pathfinder = tcod.path.Pathfinder(graph)
+            pathfinder.add_root((self.player.x, self.player.y))
+            pathfinder.resolve()
+            self._dist_map = pathfinder.distance
+
+        return self._dist_map
+
     def update_fov(self) -> None:
         """Recompute the visible area based on the players point of view."""
         self.game_map.visible[:] = compute_fov(
-            self.game_map.tiles["transparent"],
+            self.game_map.transparent_arr,
             (self.player.x, self.player.y),
             radius=8,
         )
@@ -62,6 +90,8 @@ class Engine:
                 if self.game_map.tiles[x_match[i]+dx,y_match[i]+dy]==tile_types.floor:
                     self.game_map.tiles[x_match[i]+dx,y_match[i]+dy]=tile_types.corrupted_floor
 
+            self.game_map.invalidate_tile_caches()
+
     def render(self, console: Console) -> None:
         self.game_map.render(console)
 
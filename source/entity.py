@@ -110,6 +110,22 @@ class Actor(Entity):
     def is_alive(self) -> bool:
         """Returns True as long as this actor can perform actions."""
         return bool(self.ai)
+
+    def spawn(self, gamemap: GameMap, x: int, y: int) -> Actor:
+        clone = super().spawn(gamemap, x, y)
+        gamemap.update_actor(clone)
+        return clone
+
+    def place(self, x: int, y: int, gamemap: Optional[GameMap] = None) -> None:
+        old_gamemap = self.gamemap if hasattr(self, "parent") else None
+        super().place(x, y, gamemap)
+        if old_gamemap is not None and old_gamemap is not self.gamemap:
+            old_gamemap.update_actor(self)
+        self.gamemap.update_actor(self)
+
+    def move(self, dx: int, dy: int) -> None:
+        super().move(dx, dy)
+        self.gamemap.update_actor(self)
     
 class Item(Entity):
     def __init__(
@@ -1,11 +1,12 @@
 from __future__ import annotations
 
-from typing import Iterable, Iterator, Optional, TYPE_CHECKING
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np  # type: ignore
 from tcod.console import Console
 
 from entity import Actor, Item
+from kernels import make_astar
 import tile_types
 
 if TYPE_CHECKING:
@@ -20,6 +21,15 @@ class GameMap:
         self.engine = engine
         self.width, self.height = width, height
         self.entities = set(entities)
+
+        # Structure of arrays mirror of the living actors, index i of each array
+        # describes actor_list[i].  Kept in sync through update_actor.
+        self.actor_list: List[Actor] = []
+        self.actor_xs = np.zeros(0, dtype=np.int32)
+        self.actor_ys = np.zeros(0, dtype=np.int32)
+        self.actor_factions = np.zeros(0, dtype=np.int32)
+        self._actor_slots: Dict[Actor, int] = {}
+
         self.tiles = np.full((width, height), fill_value=tile_types.wall, order="F")
 
         self.visible = np.full(
@@ -29,10 +39,92 @@ class GameMap:
             (width, height), fill_value=False, order="F"
         )  # Tiles the player has seen before
 
+        # A* compiled for this map's size, see kernels.make_astar.
+        self.astar_path = make_astar(width, height)
+
+        # Bumped whenever tiles change so caches kept outside the map can notice.
+        self.tiles_version = 0
+        # Movement cost of each tile ignoring entities, built lazily from `tiles`.
+        self._cost_base: Optional[np.ndarray] = None
+        # Contiguous copy of tiles["transparent"] for FOV, built lazily from `tiles`.
+        self._transparent_arr: Optional[np.ndarray] = None
+        # Walkability packed 64 tiles to a word, built lazily from `tiles`.
+        self._walkable_bits: Optional[np.ndarray] = None
+        # (x_idx, y_idx) of every walkable tile, built lazily from `tiles`.
+        self._walkable_indices: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # Reusable buffer the pathfinding code stamps entity costs onto.
+        self.cost_scratch = np.zeros((width, height), dtype=np.int8, order="F")
+
     @property
     def gamemap(self) -> GameMap:
         return self
 
+    @property
+    def cost_base(self) -> np.ndarray:
+        """Return the int8 movement cost of every tile, 0 meaning unwalkable."""
+        if self._cost_base is None:
+            self._cost_base = np.array(self.tiles["walkable"], dtype=np.int8, order="F")
+        return self._cost_base
+
+    @property
+    def transparent_arr(self) -> np.ndarray:
+        """Return a contiguous bool array of which tiles don't block FOV."""
+        if self._transparent_arr is None:
+            self._transparent_arr = np.ascontiguousarray(self.tiles["transparent"])
+        return self._transparent_arr
+
+    @property
+    def walkable_bits(self) -> np.ndarray:
+        """Return walkability packed into uint64 words, one row of words per column.
+
+        Tile (x, y) is bit (y & 63) of word [x, y >> 6].
+        """
+        if self._walkable_bits is None:
+            words = (self.height + 63) // 64
+            padded = np.zeros((self.width, words * 64), dtype=bool)
+            padded[:, : self.height] = self.tiles["walkable"]
+            packed = np.packbits(padded, axis=1, bitorder="little")
+            self._walkable_bits = np.ascontiguousarray(packed).view("<u8").astype(np.uint64)
+        return self._walkable_bits
+
+    @property
+    def walkable_indices(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the (x_idx, y_idx) arrays of every walkable tile."""
+        if self._walkable_indices is None:
+            self._walkable_indices = np.where(self.tiles["walkable"])
+        return self._walkable_indices
+
+    def invalidate_tile_caches(self) -> None:
+        """Drop every array derived from `tiles`, must be called after tiles change."""
+        self.tiles_version += 1
+        self._cost_base = None
+        self._transparent_arr = None
+        self._walkable_bits = None
+        self._walkable_indices = None
+
+    def get_movement_cost(self) -> np.ndarray:
+        """Return the movement cost of every tile with blocking entities stamped on.
+
+        The result is the shared `cost_scratch` buffer, so it is only valid until
+        the next call.
+        """
+        # Reset the scratch buffer to the cached walkable costs instead of
+        # allocating a fresh copy of the walkable array every call.
+        cost = self.cost_scratch
+        np.copyto(cost, self.cost_base)
+
+        # Living actors are the only entities that block movement, so the actor
+        # arrays are exactly the blocked positions.
+        blocker_xs, blocker_ys = self.actor_xs, self.actor_ys
+        blocked = cost[blocker_xs, blocker_ys]
+        # Add to the cost of a blocked position, unless the cost is zero (blocking.)
+        # A lower number means more enemies will crowd behind each other in
+        # hallways.  A higher number means enemies will take longer paths in
+        # order to surround the player.
+        cost[blocker_xs, blocker_ys] = np.where(blocked != 0, blocked + 10, 0)
+
+        return cost
+
     @property
     def actors(self) -> Iterator[Actor]:
         """Iterate over this maps living actors."""
@@ -46,6 +138,40 @@ class GameMap:
     def items(self) -> Iterator[Item]:
         yield from (entity for entity in self.entities if isinstance(entity, Item))
 
+    def update_actor(self, actor: Actor) -> None:
+        """Copy actor's position into the actor arrays, adding or dropping it as needed."""
+        slot = self._actor_slots.get(actor)
+        if not actor.is_alive or getattr(actor, "parent", None) is not self:
+            if slot is not None:
+                self._remove_actor_slot(slot)
+        elif slot is None:
+            self._actor_slots[actor] = len(self.actor_list)
+            self.actor_list.append(actor)
+            self.actor_xs = np.append(self.actor_xs, np.int32(actor.x))
+            self.actor_ys = np.append(self.actor_ys, np.int32(actor.y))
+            self.actor_factions = np.append(self.actor_factions, np.int32(actor.faction))
+        else:
+            self.actor_xs[slot] = actor.x
+            self.actor_ys[slot] = actor.y
+
+    def _remove_actor_slot(self, slot: int) -> None:
+        """Drop a slot from the actor arrays by moving the last slot into it."""
+        last = len(self.actor_list) - 1
+        actor = self.actor_list[slot]
+        moved = self.actor_list[last]
+
+        self.actor_list[slot] = moved
+        self.actor_xs[slot] = self.actor_xs[last]
+        self.actor_ys[slot] = self.actor_ys[last]
+        self.actor_factions[slot] = self.actor_factions[last]
+        self._actor_slots[moved] = slot
+        del self._actor_slots[actor]
+
+        self.actor_list.pop()
+        self.actor_xs = self.actor_xs[:last]
+        self.actor_ys = self.actor_ys[:last]
+        self.actor_factions = self.actor_factions[:last]
+
     def get_blocking_entity_at_location(
         self, location_x: int, location_y: int,
     ) -> Optional[Entity]:
@@ -0,0 +1,332 @@
+"""Compiled inner loops used by the AI components.
+
+These are compiled with numba when it is installed.  Otherwise the target scan
+falls back to numpy and pathfinding to tcod, which give the same results.  If
+build_kernels.py has been run the ahead of time compiled copies from the
+ai_kernels extension are used instead.
+"""
+from __future__ import annotations
+
+import functools
+
+import numpy as np  # type: ignore
+import tcod
+
+try:
+    from numba import njit  # type: ignore
+
+    HAS_NUMBA = True
+except ImportError:  # numba doesn't always support the newest Python release.
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        """Stand in for numba.njit that leaves the function uncompiled."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+@njit(cache=True)
+def _jit_closest_hostile(fov, xs, ys, factions, sx, sy, self_faction, radius):
+    """Return the index of the closest actor visible in fov that isn't in self_faction.
+
+    Distance is the Chebyshev distance from (sx, sy), and is returned alongside the
+    index.  Actors further than radius can't be in fov and are skipped before it
+    is read.  If there is no such actor then returns (-1, -1).
+    """
+    best_index = -1
+    best_distance = -1
+    for i in range(xs.shape[0]):
+        adx = abs(xs[i] - sx)
+        ady = abs(ys[i] - sy)
+        # Chebyshev distance, max(adx, ady) written without a branch: the mask is
+        # all ones when ady is larger and selects it, otherwise it keeps adx.
+        distance = adx ^ ((adx ^ ady) & -np.int64(adx < ady))
+        if distance > radius or factions[i] == self_faction or not fov[xs[i], ys[i]]:
+            continue
+        if best_index == -1 or distance < best_distance:
+            best_index = i
+            best_distance = distance
+            if distance <= 1:
+                break  # Nothing else can be closer than an adjacent actor.
+
+    return best_index, best_distance
+
+
+def _closest_hostile_vectorized(fov, xs, ys, factions, sx, sy, self_faction, radius):
+    """closest_hostile as whole-array numpy operations.
+
+    Used when numba is missing, where a per-actor Python loop would be far slower.
+    """
+    distances = np.maximum(np.abs(xs - sx), np.abs(ys - sy))  # Chebyshev distance.
+    near = np.flatnonzero(distances <= radius)
+    near = near[fov[xs[near], ys[near]] & (factions[near] != self_faction)]
+    if len(near) == 0:
+        return -1, -1
+
+    index = int(near[np.argmin(distances[near])])
+    return index, int(distances[index])
+
+
+if HAS_NUMBA:
+    closest_hostile = _jit_closest_hostile
+else:
+    closest_hostile = _closest_hostile_vectorized
+
+
+# (dx, dy) and cost multiplier of the eight steps an actor can take, matching the
+# cardinal=2, diagonal=3 weights of the tcod pathfinding graphs.
+STEP_DX = (-1, 0, 1, -1, 1, -1, 0, 1)
+STEP_DY = (-1, -1, -1, 0, 0, 1, 1, 1)
+STEP_WEIGHT = (3, 2, 3, 2, 2, 3, 2, 3)
+# Bit of each step in the 3x3 walkability mask built by _neighborhood_bits.
+STEP_BIT = (0, 3, 6, 1, 7, 2, 5, 8)
+
+# heap_pos markers for nodes that aren't in the open heap.
+NOT_QUEUED = -1
+CLOSED = -2
+
+
+@njit(cache=True)
+def _heuristic(x, y, dest_x, dest_y):
+    """Return the cheapest possible cost from (x, y) to (dest_x, dest_y)."""
+    dx = abs(dest_x - x)
+    dy = abs(dest_y - y)
+    # Diagonal steps cost 3 and cardinal steps 2, so this is 3 * min + 2 * (max - min).
+    return 2 * max(dx, dy) + min(dx, dy)
+
+
+@njit(cache=True)
+def _column_bits(walkable_bits, x, y):
+    """Return the walkability of rows y - 1 to y + 1 of column x as 3 bits.
+
+    walkable_bits holds bit (y & 63) of word [x, y >> 6] for every walkable tile,
+    and anything outside of the map reads as unwalkable.
+    """
+    if x < 0 or x >= walkable_bits.shape[0]:
+        return 0
+    if y == 0:
+        # There is no row above, rows 0 and 1 shift up to bits 1 and 2.
+        return np.int64(walkable_bits[x, 0] & np.uint64(3)) << 1
+
+    top = y - 1
+    word = top >> 6
+    shift = top & 63
+    bits = (walkable_bits[x, word] >> np.uint64(shift)) & np.uint64(7)
+    if shift > 61 and word + 1 < walkable_bits.shape[1]:
+        # The three rows straddle two words, pull the rest from the next one.
+        bits |= (walkable_bits[x, word + 1] << np.uint64(64 - shift)) & np.uint64(7)
+    return np.int64(bits)
+
+
+@njit(cache=True)
+def _neighborhood_bits(walkable_bits, x, y):
+    """Return a 9 bit walkability mask of the 3x3 tiles around (x, y).
+
+    Tile (x + dx, y + dy) is bit (dx + 1) * 3 + (dy + 1).
+    """
+    return (
+        _column_bits(walkable_bits, x - 1, y)
+        | (_column_bits(walkable_bits, x, y) << 3)
+        | (_column_bits(walkable_bits, x + 1, y) << 6)
+    )
+
+
+@njit(cache=True)
+def _sift_up(heap, heap_f, heap_pos, i, node, f):
+    """Move node with priority f up the heap from slot i to where it belongs."""
+    while i > 0:
+        up = (i - 1) >> 1
+        if heap_f[up] <= f:
+            break
+        heap[i] = heap[up]
+        heap_f[i] = heap_f[up]
+        heap_pos[heap[i]] = i
+        i = up
+    heap[i] = node
+    heap_f[i] = f
+    heap_pos[node] = i
+
+
+@njit(cache=True)
+def _pop_min(heap, heap_f, heap_pos, size):
+    """Remove and return the lowest priority node from a heap holding size nodes."""
+    top = heap[0]
+    heap_pos[top] = CLOSED
+    size -= 1
+    if size > 0:
+        node = heap[size]
+        f = heap_f[size]
+        i = 0
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap_f[child + 1] < heap_f[child]:
+                child += 1
+            if heap_f[child] >= f:
+                break
+            heap[i] = heap[child]
+            heap_f[i] = heap_f[child]
+            heap_pos[heap[i]] = i
+            i = child
+        heap[i] = node
+        heap_f[i] = f
+        heap_pos[node] = i
+    return top
+
+
+@njit(cache=True)
+def _astar_parents(cost, walkable_bits, width, height, sx, sy, dest_x, dest_y, max_cost):
+    """Run A* from (sx, sy) and return each tile's parent on the cheapest path found.
+
+    Tiles are numbered x * height + y, where cost is a width by height array.
+    Tiles costing more than max_cost to reach are never searched, and the goal's
+    parent is -1 if it can't be reached.  walkable_bits must mark exactly the
+    tiles where cost isn't 0.
+    """
+    size = width * height
+    start = sx * height + sy
+    goal = dest_x * height + dest_y
+    parent = np.full(size, -1, dtype=np.int32)
+    if start == goal or cost[dest_x, dest_y] == 0:
+        return parent
+
+    g = np.full(size, np.iinfo(np.int32).max, dtype=np.int32)
+    # Binary heap of open nodes ordered by f, every tile is queued at most once.
+    heap = np.empty(size, dtype=np.int32)
+    heap_f = np.empty(size, dtype=np.int32)
+    heap_pos = np.full(size, NOT_QUEUED, dtype=np.int32)
+
+    g[start] = 0
+    _sift_up(heap, heap_f, heap_pos, 0, start, _heuristic(sx, sy, dest_x, dest_y))
+    queued = 1
+    while queued > 0:
+        node = _pop_min(heap, heap_f, heap_pos, queued)
+        queued -= 1
+        if node == goal:
+            break
+
+        x = node // height
+        y = node - x * height
+        # Off map and unwalkable neighbors are filtered out with one mask, only
+        # walkable tiles need their cost read.
+        around = _neighborhood_bits(walkable_bits, x, y)
+        for k in range(8):
+            if not (around >> STEP_BIT[k]) & 1:
+                continue
+            nx = x + STEP_DX[k]
+            ny = y + STEP_DY[k]
+            neighbor = nx * height + ny
+            if heap_pos[neighbor] == CLOSED:
+                continue
+            new_g = g[node] + cost[nx, ny] * STEP_WEIGHT[k]
+            if new_g >= g[neighbor] or new_g > max_cost:
+                continue
+
+            g[neighbor] = new_g
+            parent[neighbor] = node
+            f = new_g + _heuristic(nx, ny, dest_x, dest_y)
+            if heap_pos[neighbor] == NOT_QUEUED:
+                _sift_up(heap, heap_f, heap_pos, queued, neighbor, f)
+                queued += 1
+            else:
+                _sift_up(heap, heap_f, heap_pos, heap_pos[neighbor], neighbor, f)
+
+    return parent
+
+
+@njit(cache=True)
+def _astar_path(cost, walkable_bits, width, height, sx, sy, dest_x, dest_y, max_cost):
+    """astar_path for a cost array of the given width and height."""
+    start = sx * height + sy
+    goal = dest_x * height + dest_y
+    parent = _astar_parents(
+        cost, walkable_bits, width, height, sx, sy, dest_x, dest_y, max_cost
+    )
+    if parent[goal] == -1:
+        return np.empty((0, 2), dtype=np.int32)
+
+    length = 0
+    node = goal
+    while node != start:
+        node = parent[node]
+        length += 1
+
+    # Walk back from the goal, filling the path in from its end.
+    path = np.empty((length, 2), dtype=np.int32)
+    node = goal
+    for i in range(length - 1, -1, -1):
+        path[i, 0] = node // height
+        path[i, 1] = node - (node // height) * height
+        node = parent[node]
+    return path
+
+
+@njit(cache=True)
+def _jit_astar_path(cost, walkable_bits, sx, sy, dest_x, dest_y, max_cost):
+    """Return the cheapest path from (sx, sy) to (dest_x, dest_y) as an (L, 2) array.
+
+    cost uses the same convention as tcod.path.SimpleGraph: 0 is blocked, otherwise
+    entering a tile costs its value times the step weight.  The start is left
+    out of the path, and if there is no path costing at most max_cost then the
+    array is empty.  walkable_bits is the packed walkability from
+    GameMap.walkable_bits.
+    """
+    width, height = cost.shape
+    return _astar_path(
+        cost, walkable_bits, width, height, sx, sy, dest_x, dest_y, max_cost
+    )
+
+
+def _astar_path_tcod(cost, walkable_bits, sx, sy, dest_x, dest_y, max_cost):
+    """astar_path using tcod's pathfinder.
+
+    Used when numba is missing, where the A* above would run as plain Python.
+    walkable_bits isn't needed here.
+    """
+    graph = tcod.path.SimpleGraph(cost=cost, cardinal=2, diagonal=3)
+    pathfinder = tcod.path.Pathfinder(graph)
+    pathfinder.add_root((sx, sy))
+
+    path = pathfinder.path_to((dest_x, dest_y))[1:]
+    if len(path) == 0 or pathfinder.distance[dest_x, dest_y] > max_cost:
+        return np.empty((0, 2), dtype=np.int32)
+    return path
+
+
+if HAS_NUMBA:
+    astar_path = _jit_astar_path
+else:
+    astar_path = _astar_path_tcod
+
+try:
+    # Skips the JIT warm up, see build_kernels.py.  Only the public names are
+    # replaced, build_kernels.py compiles from the _jit_ functions.
+    from ai_kernels import astar_path, closest_hostile  # type: ignore # noqa: F811
+
+    HAS_AOT = True
+except ImportError:
+    HAS_AOT = False
+
+
+@functools.lru_cache(maxsize=None)
+def make_astar(width, height):
+    """Return astar_path specialized for width by height maps.
+
+    The map size is baked into the compiled code as constants, so the index math
+    and neighbor bounds are fixed at compile time.  The generic astar_path is
+    returned instead when numba is missing, where it is tcod's pathfinder, or
+    when the ahead of time build is present since that skips compiling
+    altogether.
+    """
+    if not HAS_NUMBA or HAS_AOT:
+        return astar_path
+
+    @njit(cache=True)
+    def specialized_astar_path(cost, walkable_bits, sx, sy, dest_x, dest_y, max_cost):
+        return _astar_path(
+            cost, walkable_bits, width, height, sx, sy, dest_x, dest_y, max_cost
+        )
+
+    return specialized_astar_path